@@ -366,6 +366,10 @@ class GarmentBaseDataset(BaseDataset):
             start_config['panel_classification'] = None
         self.panel_classifier = None
 
+        if 'panel_len_multiple' not in start_config:
+            # round up the (padded) number of edges in panels to the multiple of this number, e.g. 8. Off by default
+            start_config['panel_len_multiple'] = None
+
         super().__init__(root_dir, start_config, gt_caching=gt_caching, feature_caching=feature_caching, in_transforms=in_transforms)
 
         # To make sure the datafolder names are unique after updates
@@ -460,12 +464,10 @@ class GarmentBaseDataset(BaseDataset):
 
         fails_dict = dataset_props['sim']['stats']['fails']
         # TODO allow not to ignore some of the subsections
+        fails = set()
         for subsection in fails_dict:
-            for fail in fails_dict[subsection]:
-                try:
-                    datapoints_names.remove(dataset_folder + '/' + fail)
-                except ValueError:  # if fail was already removed based on previous failure subsection
-                    pass
+            fails.update(dataset_folder + '/' + fail for fail in fails_dict[subsection])
+        datapoints_names = [name for name in datapoints_names if name not in fails]  # keeps the original order
         
         # filter by parameters
         if 'filter_by_params' in self.config and self.config['filter_by_params']:
@@ -484,14 +486,18 @@ class GarmentBaseDataset(BaseDataset):
         with open(filter_file, 'r') as f:
             param_filters = json.load(f)
 
+        # All datapoints in the folder come from the same template
+        template_filter = param_filters[self.data_folders_nicknames[dataset_folder]]
+
         final_list = []
         for datapoint_name in datapoint_names:
-            pattern = NNSewingPattern(self.root_path / datapoint_name / 'specification.json')
-            template_name = self.template_name(datapoint_name)
+            # Only parameter values are needed => no need to construct & normalize the full pattern object
+            with open(self.root_path / datapoint_name / 'specification.json', 'r') as f_json:
+                parameters = json.load(f_json)['parameters']
             to_add = True
-            for param in param_filters[template_name]:
-                value = pattern.parameters[param]['value']
-                if value < param_filters[template_name][param][0] or value > param_filters[template_name][param][1]:
+            for param, (low, high) in template_filter.items():
+                value = parameters[param]['value']
+                if value < low or value > high:
                     to_add = False
                     break
             if to_add:
@@ -521,7 +527,9 @@ class GarmentBaseDataset(BaseDataset):
         return pattern.pattern_as_tensors(
             pad_panels_to_len, pad_panels_num=pad_panel_num, pad_stitches_num=pad_stitches_num,
             with_placement=with_placement, with_stitches=with_stitches, 
-            with_stitch_tags=with_stitch_tags)
+            with_stitch_tags=with_stitch_tags,
+            pad_len_multiple=self.config['panel_len_multiple'],
+            dtype=np.float32)  # final type for NN => no conversion copies on access
 
     # -------- Generalized Utils -----
     def _unpad(self, element, tolerance=1.e-5):
@@ -556,17 +564,13 @@ class GarmentBaseDataset(BaseDataset):
         if padded:
             input_batch = self._unpad(input_batch)  # remove rows with zeros
 
-        # per dimention info
-        min_vector, _ = torch.min(input_batch, dim=0)
-        max_vector, _ = torch.max(input_batch, dim=0)
-        scale = torch.empty_like(min_vector)
+        # per dimention info -- in a single pass over the data
+        min_vector, max_vector = torch.aminmax(input_batch, dim=0)
 
         # avoid division by zero
-        for idx, (tmin, tmax) in enumerate(zip(min_vector, max_vector)): 
-            if torch.isclose(tmin, tmax):
-                scale[idx] = tmin if not torch.isclose(tmin, torch.zeros(1)) else 1.
-            else:
-                scale[idx] = tmax - tmin
+        degenerate_scale = torch.where(
+            torch.isclose(min_vector, torch.zeros_like(min_vector)), torch.ones_like(min_vector), min_vector)
+        scale = torch.where(torch.isclose(min_vector, max_vector), degenerate_scale, max_vector - min_vector)
         
         return min_vector, scale
 
@@ -581,6 +585,8 @@ class Garment3DPatternFullDataset(GarmentBaseDataset):
             start_config['mesh_samples'] = 2000  # default value if not given -- a bettern gurantee than a default value in func params
         if 'point_noise_w' not in start_config:
             start_config['point_noise_w'] = 0  # default value if not given -- a bettern gurantee than a default value in func params
+        if 'mesh_npz_cache' not in start_config:
+            start_config['mesh_npz_cache'] = False  # store binary copies of meshes next to .obj files to skip text parsing
         
         # to cache segmentation mask if enabled
         self.segm_cached = {}
@@ -832,12 +838,13 @@ class Garment3DPatternFullDataset(GarmentBaseDataset):
         if not obj_list:
             raise RuntimeError('Dataset:Error: geometry file *{}*.obj not found for {}'.format(self.config['obj_filetag'], datapoint_name))
         
-        verts, faces = igl.read_triangle_mesh(str(self.root_path / datapoint_name / obj_list[0]))
+        verts, faces = self._read_mesh(self.root_path / datapoint_name / obj_list[0])
         points = self.sample_mesh_points(self.config['mesh_samples'], verts, faces)
 
         # add gaussian noise
         if self.config['point_noise_w']:
             points += np.random.normal(loc=0.0, scale=self.config['point_noise_w'], size=points.shape)
+        points = points.astype(np.float32)  # final type for NN => zero-copy conversion to tensor on every access
 
         # Debug
         # if 'skirt_4_panels_00HUVRGNCG' in datapoint_name:
@@ -845,6 +852,25 @@ class Garment3DPatternFullDataset(GarmentBaseDataset):
         #     meshplot.plot(points, c=points[:, 0], shading={"point_size": 3.0})
         return points, verts
 
+    def _read_mesh(self, obj_path):
+        """Read vertices & faces of a given mesh. 
+            With 'mesh_npz_cache' enabled, the parsed mesh is stored in binary form next to the .obj file 
+            and is re-used on following reads (e.g. on the next runs of the same dataset)"""
+        if not self.config['mesh_npz_cache']:
+            return igl.read_triangle_mesh(str(obj_path))
+
+        npz_path = obj_path.with_suffix('.npz')
+        if npz_path.exists() and npz_path.stat().st_mtime >= obj_path.stat().st_mtime:
+            with np.load(npz_path) as mesh:
+                return mesh['verts'], mesh['faces']
+        
+        verts, faces = igl.read_triangle_mesh(str(obj_path))
+        try:
+            np.savez(npz_path, verts=verts, faces=faces)
+        except OSError as e:  # e.g. read-only dataset location
+            print(f'{self.__class__.__name__}::Warning::Mesh cache not saved for {obj_path}: {e}')
+        return verts, faces
+
     @staticmethod
     def sample_mesh_points(num_points, verts, faces):
         """A routine to sample requested number of points from a given mesh
@@ -853,13 +879,9 @@ class Garment3DPatternFullDataset(GarmentBaseDataset):
         barycentric_samples, face_ids = igl.random_points_on_mesh(num_points, verts, faces)
         face_ids[face_ids >= len(faces)] = len(faces) - 1  # workaround for https://github.com/libigl/libigl/issues/1531
 
-        # convert to world coordinates
-        points = np.empty(barycentric_samples.shape)
-        for i in range(len(face_ids)):
-            face = faces[face_ids[i]]
-            barycentric_coords = barycentric_samples[i]
-            face_verts = verts[face]
-            points[i] = np.dot(barycentric_coords, face_verts)
+        # convert to world coordinates -- for all points at once
+        face_verts = verts[faces[face_ids]]  # (num_points, 3, 3)
+        points = np.einsum('ij,ijk->ik', barycentric_samples, face_verts)
 
         return points
 
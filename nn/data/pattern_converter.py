@@ -1,4 +1,3 @@
-import copy
 from datetime import datetime
 import numpy as np
 from numpy.random import default_rng
@@ -42,13 +41,15 @@ class NNSewingPattern(VisPattern):
         """
         self.panel_classifier = panel_classifier
         self.template_name = template_name
+        self._placements = {}  # panel_name -> (euler angles, translation, rotation matrix, translation array)
+        self._panel_arrays_cache = {}  # panel_name -> (vertices list, edges list, array representation)
 
         super().__init__(pattern_file=pattern_file, view_ids=view_ids)        
 
     def pattern_as_tensors(
             self, 
             pad_panels_to_len=None, pad_panels_num=None, pad_stitches_num=None,
-            with_placement=False, with_stitches=False, with_stitch_tags=False):
+            with_placement=False, with_stitches=False, with_stitch_tags=False, pad_len_multiple=None, dtype=np.float64):
         """Return pattern in format suitable for NN inputs/outputs
             * 3D tensor of panel edges
             * 3D tensor of panel's 3D translations
@@ -56,6 +57,9 @@ class NNSewingPattern(VisPattern):
         Parameters to control padding: 
             * pad_panels_to_len -- pad the list edges of every panel to this number of edges
             * pad_panels_num -- pad the list of panels of the pattern to this number of panels
+            * pad_len_multiple -- if given, panel length (with padding) is rounded up to the multiple of this number 
+                (e.g. 8 to keep the edge dimention friendly to vectorized kernels)
+        Floating point outputs are created with given dtype (e.g. np.float32 to get the NN-ready values right away)
         """
         if sys.version_info[0] < 3:
             raise RuntimeError('BasicPattern::Error::pattern_as_tensors() is only supported for Python 3.6+ and Scipy 1.2+')
@@ -66,17 +70,18 @@ class NNSewingPattern(VisPattern):
         # Calculate max edge count among panels -- if not provided
         panel_lens = [len(self.pattern['panels'][name]['edges']) if name is not None else 0 for name in panel_order]
         max_len = pad_panels_to_len if pad_panels_to_len is not None else max(panel_lens)
-
-        # Main info per panel
-        panel_seqs, panel_translations, panel_rotations = [], [], []
-        for panel_name in panel_order:
+        if pad_len_multiple:
+            max_len = -(-max_len // pad_len_multiple) * pad_len_multiple  # round up
+
+        # Main info per panel -- written straight into the output arrays
+        # empty panels are all zeros
+        panel_seqs = np.zeros((len(panel_order), max_len, 4), dtype=dtype)
+        panel_rotations = np.zeros((len(panel_order), 4), dtype=dtype)
+        panel_translations = np.zeros((len(panel_order), 3), dtype=dtype)
+        for idx, panel_name in enumerate(panel_order):
             if panel_name is not None:
-                edges, rot, transl = self.panel_as_numeric(panel_name, pad_to_len=max_len)
-            else:  # empty panel
-                edges, rot, transl = self._empty_panel(max_len)
-            panel_seqs.append(edges)
-            panel_translations.append(transl)
-            panel_rotations.append(rot)
+                _, panel_rotations[idx], panel_translations[idx] = self.panel_as_numeric(
+                    panel_name, pad_to_len=max_len, out=panel_seqs[idx])
 
         # Stitches info. Order of stitches doesn't matter
         stitches_num = len(self.pattern['stitches']) if pad_stitches_num is None else pad_stitches_num
@@ -89,24 +94,26 @@ class NNSewingPattern(VisPattern):
         # Padded value is zero allows to treat the whole thing as index array
         # But need care when using -- as indexing will not crush when padded values are not filtered
         stitches_indicies = np.zeros((2, stitches_num), dtype=np.int64) 
+        panel_ids = {name: idx for idx, name in enumerate(panel_order) if name is not None}
         if with_stitch_tags:
             # padding happens automatically, if panels are padded =)
             stitch_tags = self.stitches_as_tags()
-            tags_per_edge = np.zeros((len(panel_seqs), len(panel_seqs[0]), stitch_tags.shape[-1]))
-        for idx, stitch in enumerate(self.pattern['stitches']):
-            for id_side, side in enumerate(stitch):
-                panel_id = panel_order.index(side['panel'])
-                edge_id = side['edge']
-                stitches_indicies[id_side][idx] = panel_id * max_len + edge_id  # pattern-level edge id
-                if with_stitch_tags:
-                    tags_per_edge[panel_id][edge_id] = stitch_tags[idx]
+            tags_per_edge = np.zeros((len(panel_order), max_len, stitch_tags.shape[-1]), dtype=dtype)
+        if len(self.pattern['stitches']):
+            # (num_stitches, 2) panel & edge ids of stitch sides
+            stitch_panels = np.array([[panel_ids[side['panel']] for side in stitch] for stitch in self.pattern['stitches']])
+            stitch_edges = np.array([[side['edge'] for side in stitch] for stitch in self.pattern['stitches']])
+
+            stitches_indicies[:, :len(stitch_panels)] = (stitch_panels * max_len + stitch_edges).T  # pattern-level edge ids
+            if with_stitch_tags:
+                tags_per_edge[stitch_panels, stitch_edges] = stitch_tags[:, None, :]  # same tag on both sides
 
         # format result as requested
-        result = [np.stack(panel_seqs), np.array(panel_lens)]
+        result = [panel_seqs, np.array(panel_lens)]
         result.append(len(self.pattern['panels']))  # actual number of panels 
         if with_placement:
-            result.append(np.stack(panel_rotations))
-            result.append(np.stack(panel_translations))
+            result.append(panel_rotations)
+            result.append(panel_translations)
         if with_stitches:
             result.append(stitches_indicies)
             result.append(len(self.pattern['stitches']))  # actual number of stitches
@@ -164,35 +171,38 @@ class NNSewingPattern(VisPattern):
                 # TODO implement mapping of pattern-level edge ids -> (panel_id, edge_id) for panels with different number of edges
                 raise NotImplementedError('BasicPattern::Recovering stitches for unpadded pattern is not supported')
             
+            # plain integer array -- no per-element tensor indexing or float division results
+            stitches = stitches.cpu().numpy() if isinstance(stitches, torch.Tensor) else np.asarray(stitches)
+            stitches = stitches.astype(np.int64)
+
             edges_per_panel = pattern_representation.shape[1]
-            for stitch_id in range(stitches.shape[1]):
-                stitch_object = []
-                if stitches[0][stitch_id] == 0 and stitches[1][stitch_id] == 0:
-                    # This is padding -- skip
-                    continue 
-                for side_id in range(stitches.shape[0]):
-                    pattern_edge_id = stitches[side_id][stitch_id]
-                    in_panel_id = int(pattern_edge_id // edges_per_panel)
+            panel_ids, edge_ids = np.divmod(stitches, edges_per_panel)  # all stitch sides at once
+            is_stitch = np.any(stitches != 0, axis=0)  # all-zero columns are padding
+            panel_ids, edge_ids = panel_ids[:, is_stitch].T.tolist(), edge_ids[:, is_stitch].T.tolist()
+            stitch_ids = np.flatnonzero(is_stitch).tolist()
 
+            for stitch_id, stitch_panels, stitch_edges in zip(stitch_ids, panel_ids, edge_ids):
+                for in_panel_id in stitch_panels:
                     if in_panel_id > (len(pattern_representation) - 1) or new_panel_ids[in_panel_id] is None:  # validity of stitch definition
                         raise InvalidPatternDefError(self.name, 'stitch {} referes to non-existing panel {}'.format(stitch_id, in_panel_id))
-                    stitch_object.append(
-                        {
-                            "panel": in_panel_order[new_panel_ids[in_panel_id]],  # map to names of filteres non-empty panels
-                            "edge": int(pattern_edge_id % edges_per_panel), 
-                        }
-                    )
-                self.pattern['stitches'].append(stitch_object)
+                self.pattern['stitches'].append([
+                    {
+                        "panel": in_panel_order[new_panel_ids[in_panel_id]],  # map to names of filteres non-empty panels
+                        "edge": in_panel_edge_id, 
+                    } for in_panel_id, in_panel_edge_id in zip(stitch_panels, stitch_edges)
+                ])
         else:
             print('BasicPattern::Warning::{}::Panels were updated but new stitches info was not provided. Stitches are removed.'.format(self.name))
 
-    def panel_as_numeric(self, panel_name, pad_to_len=None):
+    def panel_as_numeric(self, panel_name, pad_to_len=None, out=None, dtype=np.float64):
         """
             Represent panel as sequence of edges with each edge as vector of fixed length plus the info on panel placement.
             * Edges are returned in additive manner: 
                 each edge as a vector that needs to be added to previous edges to get a 2D coordinate of end vertex
             * Panel translation is represented with "universal" heuristic -- as translation of midpoint of the top-most bounding box edge
             * Panel rotation is returned as is but in quaternions
+            * out -- optional zero-filled array of (pad_to_len, 4) shape to write the edge sequence into
+            * dtype -- type of the new edge sequence array (geometry is evaluated in float64 regardless)
 
             NOTE: 
                 The conversion uses the panels edges order as is, and 
@@ -203,18 +213,23 @@ class NNSewingPattern(VisPattern):
             raise RuntimeError('BasicPattern::Error::panel_as_numeric() is only supported for Python 3.6+ and Scipy 1.2+')
 
         panel = self.pattern['panels'][panel_name]
-        vertices = np.array(panel['vertices'])
         
         # -- Construct the edge sequence in the recovered order --
-        edge_sequence = [self._edge_as_vector(vertices, edge) for edge in panel['edges']]
+        # All edges at once: edge vector (end - start) followed by (relative) curvature coords, zeros for straight edges
+        # Same as self._edge_as_vector() for every edge
+        vertices, endpoints, curvatures = self._panel_arrays(panel_name)
+        num_edges = len(endpoints)
 
         # padding if requested
-        if pad_to_len is not None:
-            if len(edge_sequence) > pad_to_len:
-                raise ValueError('BasicPattern::{}::panel {} cannot fit into requested length: {} edges to fit into {}'.format(
-                    self.name, panel_name, len(edge_sequence), pad_to_len))
-            for _ in range(len(edge_sequence), pad_to_len):
-                edge_sequence.append(np.zeros_like(edge_sequence[0]))
+        if pad_to_len is not None and num_edges > pad_to_len:
+            raise ValueError('BasicPattern::{}::panel {} cannot fit into requested length: {} edges to fit into {}'.format(
+                self.name, panel_name, num_edges, pad_to_len))
+        if out is None:
+            edge_sequence = np.zeros((pad_to_len if pad_to_len is not None else num_edges, 4), dtype=dtype)
+        else:  # pre-allocated (zero-filled) output
+            edge_sequence = out
+        edge_sequence[:num_edges, :2] = vertices[endpoints[:, 1]] - vertices[endpoints[:, 0]]
+        edge_sequence[:num_edges, 2:] = curvatures
         
         # ----- 3D placement convertion  ------
         # Global Translation (more-or-less stable across designs)
@@ -223,7 +238,7 @@ class NNSewingPattern(VisPattern):
         panel_rotation = scipy_rot.from_euler('xyz', panel['rotation'], degrees=True)  # pattern rotation follows the Maya convention: intrinsic xyz Euler Angles
         rotation_representation = np.array(panel_rotation.as_quat())
 
-        return np.stack(edge_sequence, axis=0), rotation_representation, translation
+        return edge_sequence, rotation_representation, translation
 
     def panel_from_numeric(self, panel_name, edge_sequence, rotation=None, translation=None, padded=False):
         """ Updates or creates panel from NN-compatible numeric representation
@@ -242,28 +257,26 @@ class NNSewingPattern(VisPattern):
 
         if panel_name not in self.pattern['panels']:
             # add new panel! =)
-            self.pattern['panels'][panel_name] = copy.deepcopy(panel_spec_template)
+            self.pattern['panels'][panel_name] = _json_copy(panel_spec_template)
 
         # ---- Convert edge representation ----
-        vertices = np.array([[0, 0]])  # first vertex is always at origin
-        edges = []
-        for idx in range(len(edge_sequence) - 1):
-            edge_info = edge_sequence[idx]
-            next_vert = vertices[idx] + edge_info[:2]
-            vertices = np.vstack([vertices, next_vert])
-            edges.append(self._edge_dict(idx, idx + 1, edge_info[2:4]))
+        # vertices are accumulated edge vectors, first vertex is always at origin
+        vertices = np.zeros((len(edge_sequence), 2))
+        vertices[1:] = np.cumsum(edge_sequence[:-1, :2], axis=0)
+        curvatures = edge_sequence[:, 2:4].tolist()  # all at once, instead of converting edge by edge
+        edges = [self._edge_dict(idx, idx + 1, curvatures[idx]) for idx in range(len(edge_sequence) - 1)]
 
         # last edge is a special case
         idx = len(vertices) - 1
         edge_info = edge_sequence[-1]
         fin_vert = vertices[-1] + edge_info[:2]
         if all(np.isclose(fin_vert, 0, atol=3)):  # 3 cm per coordinate is a tolerable error
-            edges.append(self._edge_dict(idx, 0, edge_info[2:4]))
+            edges.append(self._edge_dict(idx, 0, curvatures[-1]))
         else:
             print('BasicPattern::Warning::{} with panel {}::Edge sequence do not return to origin. '
                   'Creating extra vertex'.format(self.name, panel_name))
             vertices = np.vstack([vertices, fin_vert])
-            edges.append(self._edge_dict(idx, idx + 1, edge_info[2:4]))
+            edges.append(self._edge_dict(idx, idx + 1, curvatures[-1]))
 
         # update panel itself
         panel = self.pattern['panels'][panel_name]
@@ -296,27 +309,32 @@ class NNSewingPattern(VisPattern):
             * List of stitch tags for every stitch in the panel
         """
         # NOTE stitch tags values are independent from the choice of origin & edge order within a panel
-        # iterate over stitches
-        stitch_tags = []
-        for stitch in self.pattern['stitches']:
-            edge_tags = np.empty((2, 3))  # two 3D tags per edge
+        stitches = self.pattern['stitches']
+        if not len(stitches):
+            return np.array([])
+
+        # participating edges grouped by panels s.t. they are processed together
+        sides_per_panel = {}
+        for stitch_idx, stitch in enumerate(stitches):
             for side_idx, side in enumerate(stitch):
-                panel = self.pattern['panels'][side['panel']]
-                edge_endpoints = panel['edges'][side['edge']]['endpoints']
-                # get 2D locations of participating vertices -- per panel
-                edge_endpoints = np.array([
-                    panel['vertices'][edge_endpoints[side]] for side in [0, 1]
-                ])
-                # Get edges midpoints (2D)
-                edge_mean = edge_endpoints.mean(axis=0)
+                sides_per_panel.setdefault(side['panel'], ([], []))
+                sides_per_panel[side['panel']][0].append(2 * stitch_idx + side_idx)  # two 3D tags per stitch
+                sides_per_panel[side['panel']][1].append(side['edge'])
 
-                # calculate their 3D locations
-                edge_tags[side_idx] = self._point_in_3D(edge_mean, panel['rotation'], panel['translation'])
+        edge_tags = np.empty((len(stitches) * 2, 3))
+        for panel_name, (side_ids, edge_ids) in sides_per_panel.items():
+            vertices, endpoints, _ = self._panel_arrays(panel_name)
+            # Get edges midpoints (2D) as 3D points in panel local coordinates
+            edge_endpoints = endpoints[edge_ids]
+            edge_means = np.zeros((len(edge_ids), 3))
+            edge_means[:, :2] = (vertices[edge_endpoints[:, 0]] + vertices[edge_endpoints[:, 1]]) / 2
 
-            # take average
-            stitch_tags.append(edge_tags.mean(axis=0))
+            # calculate their 3D locations
+            rot_matrix, translation = self._panel_placement(panel_name)
+            edge_tags[side_ids] = edge_means.dot(rot_matrix.T) + translation
 
-        return np.array(stitch_tags)
+        # take average of the two sides
+        return (edge_tags[0::2] + edge_tags[1::2]) / 2
 
     def stitches_as_3D_pairs(self, stitch_pairs_num=None, non_stitch_pairs_num=None, randomize_edges=False, randomize_list_order=False):
         """
@@ -508,10 +526,11 @@ class NNSewingPattern(VisPattern):
         return stitches_set
 
     def _edge_dict(self, vstart, vend, curvature):
-        """Convert given info into the proper edge dictionary representation"""
+        """Convert given info into the proper edge dictionary representation. Curvature is given as list of two floats"""
         edge_dict = {'endpoints': [vstart, vend]}
-        if not all(np.isclose(curvature, 0, atol=0.01)):  # 0.01 is tolerable error for local curvature coords
-            edge_dict['curvature'] = curvature.tolist()
+        # 0.01 is tolerable error for local curvature coords. Same as np.isclose(curvature, 0, atol=0.01) w/o array overhead
+        if not (abs(curvature[0]) <= 0.01 and abs(curvature[1]) <= 0.01):
+            edge_dict['curvature'] = curvature
         return edge_dict
 
     def _3D_edges_per_panel(self, randomize_direction=False):
@@ -528,17 +547,16 @@ class NNSewingPattern(VisPattern):
         edges_3d = {}
         for panel_name in self.panel_order():
             edges_3d[panel_name] = []
-            panel = self.pattern['panels'][panel_name]
-            vertices = np.array(panel['vertices'])
+            vertices, endpoints, curvatures = self._panel_arrays(panel_name)
 
-            # To 3D
-            rot_matrix = rotation_tools.euler_xyz_to_R(panel['rotation'])
-            vertices_3d = np.stack([self._point_in_3D(vertices[i], rot_matrix, panel['translation']) for i in range(len(vertices))])
+            # To 3D -- all vertices at once
+            rot_matrix, translation = self._panel_placement(panel_name)
+            vertices_3d = np.pad(vertices, ((0, 0), (0, 1))).dot(rot_matrix.T) + translation
 
             # edge feature
-            for edge_dict in panel['edges']:
-                edge_verts = vertices_3d[edge_dict['endpoints']]  # ravel does not copy elements
-                curvature = np.array(edge_dict['curvature']) if 'curvature' in edge_dict else [0, 0]
+            for edge_endpoints, edge_curvature in zip(endpoints, curvatures):
+                edge_verts = vertices_3d[edge_endpoints]  # ravel does not copy elements
+                curvature = edge_curvature.copy()  # cached values should stay intact
 
                 if randomize_direction and rng.integers(2):
                     # flip the edge
@@ -551,6 +569,74 @@ class NNSewingPattern(VisPattern):
 
         return edges_3d
 
+    def _panel_universal_transtation(self, panel_name):
+        """Universal 3D translation of the panel: world 3D location of the mid-point of the top (in 3D) side of the panel (2D) bounding box.
+            Returns the 3D location and the corresponding 2D point in panel local coordinates
+            * Same as the base implementation, but all the candidate points are transformed to 3D at once
+        """
+        vertices, _, _ = self._panel_arrays(panel_name)
+
+        # out of 2D bounding box sides' midpoints choose the one that is highest in 3D
+        top_right = vertices.max(axis=0)
+        low_left = vertices.min(axis=0)
+        mid_x = (top_right[0] + low_left[0]) / 2
+        mid_y = (top_right[1] + low_left[1]) / 2
+        mid_points_2D = np.array([
+            [mid_x, top_right[1]], 
+            [mid_x, low_left[1]],
+            [top_right[0], mid_y],
+            [low_left[0], mid_y]
+        ])
+        rot_matrix, translation = self._panel_placement(panel_name)
+        mid_points_3D = np.pad(mid_points_2D, ((0, 0), (0, 1))).dot(rot_matrix.T) + translation
+        top_mid_point = mid_points_3D[:, 1].argmax()
+
+        return mid_points_3D[top_mid_point], mid_points_2D[top_mid_point]
+
+    def _panel_arrays(self, panel_name):
+        """Panel geometry as arrays: vertices (n, 2), edge endpoints (m, 2), edge curvatures (m, 2) -- zeros for straight edges
+            Cached per panel, re-evaluated when the panel vertices or edges lists are replaced (e.g. on load or update from tensors)
+            NOTE: in-place edits of these lists are not tracked -- use self._invalidate_panel_arrays() after such updates
+        """
+        panel = self.pattern['panels'][panel_name]
+        cached = self._panel_arrays_cache.get(panel_name)
+        if cached is None or cached[0] is not panel['vertices'] or cached[1] is not panel['edges']:
+            edges = panel['edges']
+            # panels are commonly either all-straight or all-curved -- fill curvatures with a single op in these cases
+            curved_ids = [idx for idx, edge in enumerate(edges) if 'curvature' in edge]
+            if len(curved_ids) == len(edges):
+                curvatures = np.array([edge['curvature'] for edge in edges], dtype=float).reshape(-1, 2)
+            else:
+                curvatures = np.zeros((len(edges), 2))
+                if curved_ids:
+                    curvatures[curved_ids] = [edges[idx]['curvature'] for idx in curved_ids]
+
+            arrays = (
+                np.array(panel['vertices'], dtype=float).reshape(-1, 2),
+                np.array([edge['endpoints'] for edge in edges], dtype=int).reshape(-1, 2),
+                curvatures
+            )
+            # keeping references to the source lists for the identity check
+            cached = (panel['vertices'], panel['edges'], arrays)
+            self._panel_arrays_cache[panel_name] = cached
+        return cached[2]
+
+    def _invalidate_panel_arrays(self):
+        self._panel_arrays_cache = {}
+
+    def _panel_placement(self, panel_name):
+        """3D rotation matrix of the panel (from its 'xyz' Euler angles) and its translation as array. 
+            Cached per panel -- re-evaluated only when panel rotation or translation changes"""
+        panel = self.pattern['panels'][panel_name]
+        rotation, translation = tuple(panel['rotation']), tuple(panel['translation'])
+        cached = self._placements.get(panel_name)
+        if cached is None or cached[0] != rotation or cached[1] != translation:
+            cached = (
+                rotation, translation, 
+                rotation_tools.euler_xyz_to_R(panel['rotation']), np.array(translation, dtype=float))
+            self._placements[panel_name] = cached
+        return cached[2], cached[3]
+
     def _stitch_entry(self, panel_1, edge_1, panel_2, edge_2, score=None):
         """ element of a stitch list with given parameters (all need to be json-serializible)"""
         return [
@@ -566,10 +652,14 @@ class NNSewingPattern(VisPattern):
             },
         ]
 
-    def _empty_panel(self, max_edge_num):
-        """ Shape, rotation, and translation for empty panels"""
-        # edge is 4-elem vector, 4 rotation element for quaternion, 3 element for world translation
-        return np.zeros((max_edge_num, 4)), np.zeros(4), np.zeros(3)
+    # overloading the loading routines to drop cached panel info
+    def reloadJSON(self, *args, **kwargs):
+        self._invalidate_panel_arrays()
+        return super().reloadJSON(*args, **kwargs)
+
+    def _restore(self, *args, **kwargs):
+        self._invalidate_panel_arrays()
+        return super()._restore(*args, **kwargs)
 
     # ordering of panels according to classification
     def panel_order(self, force_update=False, pad_to_len=None):
@@ -611,6 +701,17 @@ class NNSewingPattern(VisPattern):
         return order
 
 
+# ---------- Utils -------------
+def _json_copy(value):
+    """Deep copy of JSON-like structure (nested dicts & lists of plain values). 
+        Much cheaper than copy.deepcopy() as no memo & type dispatch is needed"""
+    if isinstance(value, dict):
+        return {key: _json_copy(elem) for key, elem in value.items()}
+    if isinstance(value, list):
+        return [_json_copy(elem) for elem in value]
+    return value
+
+
 # ---------- test -------------
 if __name__ == "__main__":
     # the pattern converter loading check
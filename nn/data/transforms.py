@@ -14,10 +14,10 @@ def _dict_to_tensors(dict_obj):  # helper
         elif isinstance(value, str):  # no changes for strings
             new_dict[key] = value
         elif isinstance(value, np.ndarray):
-            new_dict[key] = torch.from_numpy(value)
+            new_dict[key] = torch.from_numpy(value)  # shares memory with value
 
             # TODO more stable way of converting the types (or detecting ints)
-            if value.dtype not in [np.int64, np.bool_]:
+            if value.dtype not in [np.int64, np.bool_, np.float32]:  # float32 needs no conversion copy
                 new_dict[key] = new_dict[key].float()  # cast all doubles and ofther stuff to floats
         else:
             new_dict[key] = torch.tensor(value)  # just try directly, if nothing else works
@@ -1,9 +1,9 @@
-import copy
 import numpy as np
 from pathlib import Path
 import random
 
 import torch
+from torch.utils.data import DataLoader, Dataset, default_collate
 import igl
 # import meshplot  # when uncommented, could lead to problems with wandb run syncing
 
@@ -52,7 +52,7 @@ class BalancedBatchSampler():
 
 
     def __iter__(self):
-        ids_by_type = copy.deepcopy(self.data_ids_by_type)
+        ids_by_type = {data_class: list(ids) for data_class, ids in self.data_ids_by_type.items()}  # lists of ints -- no need for deepcopy
 
         # shuffle
         for data_class in ids_by_type:
@@ -92,6 +92,83 @@ class BalancedBatchSampler():
         return self.num_full_batches + (not self.drop_last)
 
 
+# -------------- Collation ----------
+def collate_samples(samples):
+    """Batch garment samples: tensors are stacked, non-tensor info (names, data folders) is gathered in lists.
+        Faster alternative to the default collation for the known sample structure 
+        (dicts of tensors & strings) -- no generic type dispatch per element
+    """
+    return _collate_values(samples)
+
+
+def _collate_values(values):
+    first = values[0]
+    if isinstance(first, dict):
+        return {key: _collate_values([value[key] for value in values]) for key in first}
+    if torch.is_tensor(first):
+        # default collation for tensors knows how to stack into shared memory when in worker processes
+        return default_collate(values)
+    return list(values)
+
+
+# -------------- Device-resident data ----------
+class DeviceCachedDataset(Dataset):
+    """Keeps all the samples of given (small) dataset as batched tensors on the target device
+        => no per-batch host-to-device copies when training
+        * Samples are read (and transformed) once on creation, so create it after standardization
+        * Element order is preserved, so the samplers built for given dataset can be reused
+    """
+    def __init__(self, dataset, device):
+        self.device = device
+        self.size = len(dataset)
+        # Default collation to stack everything into one big batch
+        all_samples = next(iter(DataLoader(dataset, batch_size=self.size, shuffle=False)))
+        self.samples = self._to_device(all_samples)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        return self._take(self.samples, idx)
+
+    def __getitems__(self, indices):
+        """Whole batch at once: one indexing op per data field, result is already a batch (no collation needed)"""
+        return self._take_batch(self.samples, torch.as_tensor(indices, device=self.device), indices)
+
+    def _to_device(self, element):
+        if isinstance(element, dict):
+            return {key: self._to_device(value) for key, value in element.items()}
+        if torch.is_tensor(element):
+            return element.to(self.device)
+        return element  # names, etc.
+
+    def _take(self, element, idx):
+        if isinstance(element, dict):
+            return {key: self._take(value, idx) for key, value in element.items()}
+        return element[idx]
+
+    def _take_batch(self, element, ids_tensor, ids_list):
+        if isinstance(element, dict):
+            return {key: self._take_batch(value, ids_tensor, ids_list) for key, value in element.items()}
+        if torch.is_tensor(element):
+            return element[ids_tensor]
+        return [element[idx] for idx in ids_list]  # names, etc. stay lists
+
+
+def pass_batch_through(batch):
+    """Collation for datasets that return complete batches (e.g. DeviceCachedDataset)"""
+    return batch
+
+
+def tensors_to(data, device, non_blocking=False):
+    """Move tensor or dict of tensors to the given device. Other values are returned as is"""
+    if isinstance(data, dict):
+        return {key: tensors_to(value, device, non_blocking) for key, value in data.items()}
+    if torch.is_tensor(data):
+        return data.to(device, non_blocking=non_blocking)
+    return data
+
+
 # ------------------------- Utils for non-dataset examples --------------------------
 def sample_points_from_meshes(mesh_paths, data_config):
     """
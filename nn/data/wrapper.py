@@ -9,7 +9,7 @@ import torch
 from torch.utils.data import DataLoader, Subset
 
 # My modules
-from nn.data.utils import BalancedBatchSampler
+from nn.data.utils import BalancedBatchSampler, DeviceCachedDataset, collate_samples, pass_batch_through, tensors_to
 
 
 # ---------------------- Main Wrapper ------------------
@@ -17,10 +17,17 @@ class DatasetWrapper(object):
     """Resposible for keeping dataset, its splits, loaders & processing routines.
         Allows to reproduce earlier splits
     """
-    def __init__(self, in_dataset, known_split=None, batch_size=None, shuffle_train=True):
-        """Initialize wrapping around provided dataset. If splits/batch_size is known """
+    def __init__(self, in_dataset, known_split=None, batch_size=None, shuffle_train=True, pin_memory=None, num_workers=0, prefetch_factor=2):
+        """Initialize wrapping around provided dataset. If splits/batch_size is known 
+            pin_memory=None -- pin batches only when CUDA is available
+            num_workers -- # of loading processes for train/validation/test loaders. 
+                NOTE with caching enabled each worker keeps its own copy of the cache
+        """
 
         self.dataset = in_dataset
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
         self.data_section_list = ['full', 'train', 'validation', 'test']
 
         self.training = in_dataset
@@ -70,7 +77,7 @@ class DatasetWrapper(object):
         if self.batch_size is None:
             raise RuntimeError('DataWrapper:Error:cannot create loaders: batch_size is not set')
 
-        self.loaders.full = DataLoader(self.dataset, self.batch_size)
+        self.loaders.full = self._new_loader(self.dataset, self.batch_size)
         if self.full_per_datafolder is None:
             self.full_per_datafolder = self.dataset.subsets_per_datafolder()
         self.loaders.full_per_data_folder = self._loaders_dict(self.full_per_datafolder, self.batch_size)
@@ -82,33 +89,73 @@ class DatasetWrapper(object):
                 # indices IN the training set breakdown per type
                 _, train_indices_per_type = self.dataset.indices_by_data_folder(self.training.indices)
                 batch_sampler = BalancedBatchSampler(train_indices_per_type, batch_size=self.batch_size)
-                self.loaders.train = DataLoader(self.training, batch_sampler=batch_sampler)
+                self.loaders.train = self._new_loader(self.training, batch_sampler=batch_sampler, parallel=True)
             except (AttributeError, NotImplementedError) as e:  # cannot create balanced batches
                 print('{}::Warning::Failed to create balanced batches for training. Using default sampling'.format(self.__class__.__name__))
                 self.dataset.config['balanced_batch_sampling'] = False
-                self.loaders.train = DataLoader(self.training, self.batch_size, shuffle=shuffle_train)
+                self.loaders.train = self._new_loader(self.training, self.batch_size, shuffle=shuffle_train, parallel=True)
             # no need for breakdown per datafolder for training -- for now
 
-            self.loaders.validation = DataLoader(self.validation, self.batch_size)
+            self.loaders.validation = self._new_loader(self.validation, self.batch_size, parallel=True)
             self.loaders.valid_per_data_folder = self._loaders_dict(self.validation_per_datafolder, self.batch_size) 
 
             # loader with one example per garment type -- for visualization of the training process
             single_sample_ids = [folder_ids.indices[0] for folder_ids in self.validation_per_datafolder.values()]
-            self.loaders.valid_single_per_data = DataLoader(
+            self.loaders.valid_single_per_data = self._new_loader(
                 Subset(self.dataset, single_sample_ids), batch_size=self.batch_size, shuffle=False) 
 
-            self.loaders.test = DataLoader(self.test, self.batch_size)
+            self.loaders.test = self._new_loader(self.test, self.batch_size, parallel=True)
             self.loaders.test_per_data_folder = self._loaders_dict(self.test_per_datafolder, self.batch_size)
 
         return self.loaders.train, self.loaders.validation, self.loaders.test
 
+    def cache_on_device(self, device, shuffle_train=True):
+        """Keep training & validation data on the given device and re-create their loaders accordingly.
+            Only for datasets that fit into device memory. Call after the data was standardized
+            NOTE device memory cannot be pinned and is not shared with worker processes
+        """
+        if self.validation is None:
+            raise RuntimeError('DataWrapper::Error::cannot cache data on device: data split is not set')
+
+        print('{}::Storing training & validation data on {}'.format(self.__class__.__name__, device))
+        training = DeviceCachedDataset(self.training, device)
+        # cached datasets gather whole batches at once => no per-sample fetching & collation
+        if self.dataset.config['balanced_batch_sampling']:
+            # same element order as in self.training => the same sampler works
+            self.loaders.train = DataLoader(
+                training, batch_sampler=self.loaders.train.batch_sampler, collate_fn=pass_batch_through)
+        else:
+            self.loaders.train = DataLoader(
+                training, self.batch_size, shuffle=shuffle_train, collate_fn=pass_batch_through)
+        self.loaders.validation = DataLoader(
+            DeviceCachedDataset(self.validation, device), self.batch_size, collate_fn=pass_batch_through)
+
+        return self.loaders.train, self.loaders.validation
+
     def _loaders_dict(self, subsets_dict, batch_size, shuffle=False):
         """Create loaders for all subsets in dict"""
         loaders_dict = {}
         for name, subset in subsets_dict.items():
-            loaders_dict[name] = DataLoader(subset, batch_size, shuffle=shuffle)
+            loaders_dict[name] = self._new_loader(subset, batch_size, shuffle=shuffle)
         return loaders_dict
 
+    def _new_loader(self, subset, batch_size=1, parallel=False, **kwargs):
+        """Create loader with the options shared by all data sections
+            NOTE default collate pins all tensors in the batch dict and keeps the non-tensor fields (names, folders) as is
+            * parallel -- use worker processes (if any are requested). 
+                Per-datafolder loaders stay in the main process to avoid spawning workers for each of them
+        """
+        if parallel and self.num_workers > 0:
+            kwargs.update(
+                num_workers=self.num_workers,
+                prefetch_factor=self.prefetch_factor,
+                persistent_workers=True,  # keep workers (and their caches) alive between epochs
+                worker_init_fn=_seed_worker
+            )
+        if 'batch_sampler' in kwargs:
+            return DataLoader(subset, pin_memory=self.pin_memory, collate_fn=collate_samples, **kwargs)
+        return DataLoader(subset, batch_size, pin_memory=self.pin_memory, collate_fn=collate_samples, **kwargs)
+
     # -------- Reproducibility ---------------
     def new_split(self, valid, test=None, random_seed=None):
         """Creates train/validation or train/validation/test splits
@@ -172,6 +219,18 @@ class DatasetWrapper(object):
 
         return self.training, self.validation, self.test
 
+    def save_split(self, filename):
+        """Save current split as lists of datapoint names. 
+            The file can be used as 'filename' in split info to reproduce the split exactly (without re-sampling)"""
+        names = self.dataset.datapoints_names
+        split_datanames = {
+            'training': [names[idx] for idx in self.training.indices],
+            'validation': [names[idx] for idx in self.validation.indices] if self.validation else [],
+            'test': [names[idx] for idx in self.test.indices] if self.test else []
+        }
+        with open(filename, 'w') as f_json:
+            json.dump(split_datanames, f_json, indent=2, sort_keys=True)
+
     def print_subset_stats(self, subset_breakdown_dict, total_len, subset_name='', log_to_config=True):
         """Print stats on the elements of each datafolder contained in given subset"""
         # gouped by data_folders
@@ -192,12 +251,7 @@ class DatasetWrapper(object):
         # Split
         experiment.add_config('data_split', self.split_info)
         # save serialized split s.t. it's loaded to wandb
-        split_datanames = {}
-        split_datanames['training'] = [self.dataset.datapoints_names[idx] for idx in self.training.indices]
-        split_datanames['validation'] = [self.dataset.datapoints_names[idx] for idx in self.validation.indices]
-        split_datanames['test'] = [self.dataset.datapoints_names[idx] for idx in self.test.indices]
-        with open(experiment.local_wandb_path() / 'data_split.json', 'w') as f_json:
-            json.dump(split_datanames, f_json, indent=2, sort_keys=True)
+        self.save_split(experiment.local_wandb_path() / 'data_split.json')
 
         # data info
         self.dataset.save_to_wandb(experiment)
@@ -228,8 +282,7 @@ class DatasetWrapper(object):
             with torch.no_grad():
                 loader = self.get_loader(section)
                 if loader:
-                    for batch in loader:
-                        features_device = batch['features'].to(device)
+                    for batch, features_device in self.device_batches(loader, device):
                         preds = model(features_device)
                         self.dataset.save_prediction_batch(
                             preds, batch['name'], batch['data_folder'], section_dir, features=batch['features'].numpy(), 
@@ -243,3 +296,52 @@ class DatasetWrapper(object):
 
         return prediction_path
 
+    def device_batches(self, loader, device, with_ground_truth=False):
+        """Iterate over loader batches together with their features moved to the device. 
+            On GPU, the features of the next batch are copied on a side stream while the current one is processed
+            * with_ground_truth -- also move ground truth tensors (batch['ground_truth'] is replaced by its device copy)
+        """
+        device = torch.device(device)
+        if device.type != 'cuda':
+            for batch in loader:
+                if with_ground_truth:
+                    batch['ground_truth'] = tensors_to(batch['ground_truth'], device)
+                yield batch, batch['features'].to(device)
+            return
+
+        copy_stream = torch.cuda.Stream(device)
+        compute_stream = torch.cuda.current_stream(device)
+        current = None
+        for batch in loader:
+            if current is not None:
+                # the copy of the current batch is done before the copy of the next one is issued
+                compute_stream.wait_stream(copy_stream)
+                self._record_stream(current, compute_stream)
+            with torch.cuda.stream(copy_stream):
+                features = batch['features'].to(device, non_blocking=True)  # overlaps with processing of current batch
+                if with_ground_truth:
+                    batch['ground_truth'] = tensors_to(batch['ground_truth'], device, non_blocking=True)
+            if current is not None:
+                yield current
+            current = (batch, features)
+
+        if current is not None:
+            compute_stream.wait_stream(copy_stream)
+            self._record_stream(current, compute_stream)
+            yield current
+
+    def _record_stream(self, device_batch, stream):
+        """Mark tensors copied on a side stream as used by the given stream s.t. their memory is not reused too early"""
+        batch, features = device_batch
+        features.record_stream(stream)
+        ground_truth = batch['ground_truth'] if 'ground_truth' in batch else None
+        for tensor in (ground_truth.values() if isinstance(ground_truth, dict) else [ground_truth]):
+            if isinstance(tensor, torch.Tensor) and tensor.is_cuda:
+                tensor.record_stream(stream)
+
+
+def _seed_worker(worker_id):
+    """Make numpy & random generators in data loading workers follow the torch seed"""
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
@@ -47,6 +47,12 @@ def get_values_from_args():
     parser.add_argument(
         '--save_tag', '-s', help='Tag the output directory name with this str', type=str, 
         default='per_sample')
+    parser.add_argument(
+        '--compile', '-c', help='Compile the shape model before prediction. Pays off only on large inputs / batches', 
+        action='store_true')
+    parser.add_argument(
+        '--half', help='Send inputs to GPU in float16 and run the shape model under autocast (standardization stays in float32)', 
+        action='store_true')
 
     args = parser.parse_args()
     print(args)
@@ -79,7 +85,7 @@ def get_values_from_args():
     saving_path = Path(system_info['output']) / (args.save_tag + '_' + datetime.now().strftime('%y%m%d-%H-%M-%S'))
     saving_path.mkdir(parents=True)
 
-    return shape_config, stitch_config, paths_list, saving_path
+    return shape_config, stitch_config, paths_list, saving_path, args.compile, args.half
 
 
 def sample_points_obj(filename, num_points):
@@ -102,20 +108,15 @@ def sample_points_obj(filename, num_points):
 
 def load_points(filename):
     """Load point cloud from .txt file with point coordinates"""
-    with open(filename, 'r') as pc_file: 
-        points = []
-        for line in pc_file:
-            coords = [float(x) for x in line.split()]
-            coords = coords[:3]
-            points.append(coords)
-    points = np.array(points)
-    return points
+    # only the first three numbers in each line are coordinates
+    return np.loadtxt(filename, dtype=np.float32, usecols=(0, 1, 2), ndmin=2)
 
 if __name__ == "__main__":
     
     system_info = customconfig.Properties('./system.json')
     device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
-    shape_config, stitch_config, sample_paths, save_to = get_values_from_args()
+    shape_config, stitch_config, sample_paths, save_to, with_compile, with_half = get_values_from_args()
+    with_half = with_half and torch.cuda.is_available()  # float16 inference is only worth it on GPU
 
     # --------------- Experiment to evaluate on ---------
     shape_experiment = ExperimentWrappper(shape_config, system_info['wandb_username'])
@@ -142,16 +143,41 @@ if __name__ == "__main__":
            
         if 'standardize' in data_config:
             points = (points - data_config['standardize']['f_shift']) / data_config['standardize']['f_scale']
-        points_list.append(torch.tensor(points).float())
+        points_list.append(torch.from_numpy(np.asarray(points, dtype=np.float32)))  # no extra copy for float32 data
 
     # ----- Model (Pattern Shape) architecture -----
     shape_model = shape_experiment.load_model()
     shape_model.eval()
+    eager_module = shape_model.module
+    if with_compile:
+        torch.backends.cudnn.benchmark = True  # input shape is fixed for the run
+        try:
+            shape_model.module = torch.compile(shape_model.module, mode='reduce-overhead', fullgraph=False)
+        except (AttributeError, RuntimeError) as e:  # older PyTorch or unsupported platform
+            print(f'Warning::Model compilation is not available, using eager mode: {e}')
 
     # -------- Predict Shape ---------
     with torch.no_grad():
-        points_batch = torch.stack(points_list).to(device)
-        predictions = shape_model(points_batch)
+        # stack directly into pinned memory s.t. the transfer to GPU does not need an extra staging copy
+        points_batch = torch.empty(
+            (len(points_list), ) + points_list[0].shape, 
+            dtype=torch.float16 if with_half else torch.float32, pin_memory=torch.cuda.is_available())
+        for idx, points in enumerate(points_list):
+            points_batch[idx].copy_(points)  # converts to float16 if needed
+        points_batch = points_batch.to(device, non_blocking=True)
+        with torch.autocast('cuda', dtype=torch.float16, enabled=with_half):
+            try:
+                # torch.compile is lazy -- backend failures only show up on the first call
+                predictions = shape_model(points_batch)
+            except Exception as e:
+                if shape_model.module is eager_module:
+                    raise
+                print(f'Warning::Compiled model failed to run, using eager mode: {e}')
+                shape_model.module = eager_module
+                predictions = shape_model(points_batch)
+        if with_half:  # the rest of processing expects full precision
+            predictions = {key: value.float() if torch.is_tensor(value) and torch.is_floating_point(value) else value 
+                           for key, value in predictions.items()}
 
     # ---- save shapes ----
     saving_path = save_to / 'shape'
@@ -656,6 +656,7 @@ class ComposedPatternLoss():
     def _batch_edge_order_match(predicted_panels, gt_panels, gt_num_edges):
         """
             Try different first edges of GT panels to find the one best matching with prediction
+            * All loop origins of all panels are evaluated at once
         """
         batch_size = predicted_panels.shape[0]
         if len(predicted_panels.shape) > 3:
@@ -663,64 +664,57 @@ class ComposedPatternLoss():
         if gt_panels is not None and len(gt_panels.shape) > 3:
             gt_panels = gt_panels.view(-1, gt_panels.shape[-2], gt_panels.shape[-1])
         
-        chosen_panels = []
-        leading_edges = []
         # choose the closest version of original panel for each predicted panel
         with torch.no_grad():
-            for el_id in range(predicted_panels.shape[0]):
-                num_edges = gt_num_edges[el_id]
+            num_panels, max_panel_len = gt_panels.shape[0], gt_panels.shape[1]
+            device = gt_panels.device
+            num_edges = torch.as_tensor(gt_num_edges, device=device).long().view(-1, 1)
 
-                # Find loop origin with min distance to predicted panel
-                chosen_panel, leading_edge, _ = ComposedPatternLoss._panel_egde_match(
-                    predicted_panels[el_id], gt_panels[el_id], num_edges)
+            # (num_panels, num_origins, max_panel_len) -- every possible loop origin for every panel
+            origins = torch.arange(max_panel_len, device=device).expand(num_panels, -1)
+            shifted_ids = ComposedPatternLoss._loop_shift_ids(origins.unsqueeze(-1), num_edges.unsqueeze(-1), max_panel_len)
+            shifted_gt_panels = gt_panels[torch.arange(num_panels, device=device).view(-1, 1, 1), shifted_ids]
 
-                # update choice
-                chosen_panels.append(chosen_panel)
-                leading_edges.append(leading_edge)
+            # Find loop origin with min distance to predicted panel
+            dists = ((predicted_panels.unsqueeze(1) - shifted_gt_panels) ** 2).sum(dim=(2, 3))
+            dists[(origins >= num_edges) & (origins > 0)] = float('inf')  # non-existing origins (and empty panels)
+            leading_edges = dists.argmin(dim=1)  # first of the min values -> default origin on ties
 
-        chosen_panels = torch.stack(chosen_panels).to(predicted_panels.device)
+            chosen_panels = shifted_gt_panels[torch.arange(num_panels, device=device), leading_edges]
+
+        chosen_panels = chosen_panels.to(predicted_panels.device)
 
         # reshape into pattern batch
-        return chosen_panels.view(batch_size, -1, gt_panels.shape[-2], gt_panels.shape[-1]), leading_edges
+        return chosen_panels.view(batch_size, -1, gt_panels.shape[-2], gt_panels.shape[-1]), leading_edges.tolist()
 
     @staticmethod
-    def _panel_egde_match(pred_panel, gt_panel, num_edges):
-        """
-            Find the optimal origin for gt panel that matches with the pred_panel best
-        """
-        shifted_gt_panel = gt_panel
-        min_dist = ((pred_panel - shifted_gt_panel) ** 2).sum()
-        chosen_panel = shifted_gt_panel
-        leading_edge = 0
-        for i in range(1, num_edges):  # will skip comparison if num_edges is 0 -- empty panels
-            shifted_gt_panel = ComposedPatternLoss._rotate_edges(shifted_gt_panel, num_edges)
-            dist = ((pred_panel - shifted_gt_panel) ** 2).sum()
-            if dist < min_dist:
-                min_dist = dist
-                chosen_panel = shifted_gt_panel
-                leading_edge = i
-        
-        return chosen_panel, leading_edge, min_dist
+    def _loop_shift_ids(leading_edges, num_edges, max_panel_len):
+        """
+            Edge ids that re-start the edge loop of the panels from the leading edges. 
+            Padded area is left in place. Arguments are broadcasted against the edge ids (last dimention)
+        """
+        edge_ids = torch.arange(max_panel_len, device=num_edges.device)
+        return torch.where(edge_ids < num_edges, (edge_ids + leading_edges) % num_edges.clamp(min=1), edge_ids)
 
     @staticmethod
     def _per_panel_shift(panel_features, per_panel_leading_edges, panel_num_edges):
         """
             Shift given panel features accorging to the new edge loop orientations given
         """
-        pattern_size = panel_features.shape[1]
         with torch.no_grad():
-            for pattern_idx in range(len(panel_features)):
-                for panel_idx in range(pattern_size):
-                    edge_id = per_panel_leading_edges[pattern_idx * pattern_size + panel_idx] 
-                    num_edges = panel_num_edges[pattern_idx * pattern_size + panel_idx]       
-                    if num_edges < 3:  # just skip empty panels
-                        continue
-                    if edge_id:  # not zero -- shift needed. For empty panels its always zero
-                        current_panel = panel_features[pattern_idx][panel_idx]
-                        # requested edge goes into the first place
-                        # padded area is left in place
-                        panel_features[pattern_idx][panel_idx] = torch.cat(
-                            (current_panel[edge_id:num_edges], current_panel[: edge_id], current_panel[num_edges:]))
+            device = panel_features.device
+            features = panel_features.view(-1, *panel_features.shape[2:])  # flat list of panels, shares memory
+            leading_edges = torch.as_tensor(per_panel_leading_edges, device=device).long()
+            num_edges = torch.as_tensor(panel_num_edges, device=device).long()
+
+            # only panels that need a shift: not zero leading edge, empty panels are skipped
+            to_shift = ((leading_edges != 0) & (num_edges >= 3)).nonzero().view(-1)
+            if len(to_shift):
+                # requested edge goes into the first place
+                # padded area is left in place
+                shifted_ids = ComposedPatternLoss._loop_shift_ids(
+                    leading_edges[to_shift].unsqueeze(-1), num_edges[to_shift].unsqueeze(-1), features.shape[1])
+                features[to_shift] = features[to_shift.unsqueeze(-1), shifted_ids]
         return panel_features
 
     @staticmethod
@@ -733,33 +727,26 @@ class ComposedPatternLoss():
             Re-number the edges in ground truth according to the perdiction-gt edges mapping indicated in per_panel_leading_edges
         """
         with torch.no_grad():  # GT updates don't require gradient compute
-            # add pattern dimention
-            for pattern_id in range(len(gt_stitches)):
-                # re-assign GT edge ids according to shift
-                for side in (0, 1):
-                    for i in range(gt_stitches_nums[pattern_id]):
-                        edge_id = gt_stitches[pattern_id][side][i]
-                        panel_id = edge_id // max_panel_len
-                        global_panel_id = pattern_id * max_num_panels + panel_id  # panel id in the batch
-                        new_ledge = per_panel_leading_edges[global_panel_id]
-                        panel_num_edges = gt_num_edges[global_panel_id]  # never references to empty (padding) panel->always positive number
-
-                        inner_panel_id = edge_id - (panel_id * max_panel_len)  # edge id within panel
-                        
-                        # shift edge within panel
-                        new_in_panel_id = inner_panel_id - new_ledge if inner_panel_id >= new_ledge else (
-                            panel_num_edges - (new_ledge - inner_panel_id))
-                        # update with pattern-level edge id
-                        gt_stitches[pattern_id][side][i] = panel_id * max_panel_len + new_in_panel_id
+            device = gt_stitches.device
+            leading_edges = torch.as_tensor(per_panel_leading_edges, dtype=torch.long, device=device)
+            num_edges = torch.as_tensor(gt_num_edges, dtype=torch.long, device=device)
+
+            # all stitches of all patterns at once; padded stitches are left as is
+            num_stitches = torch.as_tensor(gt_stitches_nums, device=device).view(-1, 1, 1)
+            is_stitch = torch.arange(gt_stitches.shape[-1], device=device) < num_stitches
+
+            edge_ids = gt_stitches.long()
+            panel_ids = edge_ids // max_panel_len
+            global_panel_ids = torch.arange(len(gt_stitches), device=device).view(-1, 1, 1) * max_num_panels + panel_ids  # panel id in the batch
+            inner_panel_ids = edge_ids - panel_ids * max_panel_len  # edge id within panel
+
+            # shift edge within panel: the edge at new leading position goes to 0
+            # padded stitches may refer to empty panels -> avoid division by zero
+            panel_num_edges = num_edges[global_panel_ids].clamp(min=1)
+            new_in_panel_ids = (inner_panel_ids - leading_edges[global_panel_ids]) % panel_num_edges
+
+            # update with pattern-level edge id
+            gt_stitches[:] = torch.where(
+                is_stitch, panel_ids * max_panel_len + new_in_panel_ids, edge_ids).to(gt_stitches.dtype)
                 
         return gt_stitches
-
-    @staticmethod
-    def _rotate_edges(panel, num_edges):
-        """
-            Rotate the start of the loop to the next edge
-        """
-        panel = torch.cat((panel[1:num_edges], panel[0:1, :], panel[num_edges:]))
-
-        return panel
-
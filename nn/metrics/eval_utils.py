@@ -6,6 +6,7 @@ import torch
 
 # My modules
 from nn.data import InvalidPatternDefError
+from nn.data.utils import tensors_to
 
 
 # ------- Model evaluation shortcut -------------
@@ -50,26 +51,32 @@ def _eval_metrics_per_loader(model, loss, loader, device):
             print(e)
             continue
 
-        features, gt = batch['features'].to(device), batch['ground_truth']
+        # async copies (from pinned memory) run while the model is busy with the forward pass
+        features = batch['features'].to(device, non_blocking=True)
+        gt = batch['ground_truth']
         if gt is None or (hasattr(gt, 'nelement') and gt.nelement() == 0):  # assume reconstruction task
             gt = features
+        else:
+            gt = tensors_to(gt, device, non_blocking=True)
 
         # loss evaluation
         full_loss, loss_dict, _ = loss(model(features), gt, names=batch['name'])  # use names for cleaner errors when needed
 
         # gathering up
-        current_metrics['full_loss'].append(full_loss.cpu().numpy())
+        # kept on device to avoid a host sync on every batch
+        current_metrics['full_loss'].append(full_loss.detach())
         for key, value in loss_dict.items():
             if key not in current_metrics:
                 current_metrics[key] = []  # init new metric
             if value is not None:  # otherwise skip this one from accounting for!
-                value = value.cpu().numpy() if isinstance(value, torch.Tensor) else value
+                value = value.detach() if isinstance(value, torch.Tensor) else value
                 current_metrics[key].append(value)  
 
-    # sum & normalize 
+    # sum & normalize -- single transfer to host per metric
     for metric in current_metrics:
         if len(current_metrics[metric]):
-            current_metrics[metric] = sum(current_metrics[metric]) / len(current_metrics[metric])
+            mean_value = sum(current_metrics[metric]) / len(current_metrics[metric])
+            current_metrics[metric] = mean_value.cpu().numpy() if isinstance(mean_value, torch.Tensor) else mean_value
         else:
             current_metrics[metric] = None
 
@@ -27,23 +27,28 @@ class PanelLoopLoss():
         if len(predicted_panels.shape) > 3:
             predicted_panels = predicted_panels.view(-1, predicted_panels.shape[-2], predicted_panels.shape[-1])
 
-        # correct devices
-        self.pad_vector = self.pad_vector.to(predicted_panels.device)
+        # correct devices -- only moved once, then the device copy is reused
+        if self.pad_vector.device != predicted_panels.device:
+            self.pad_vector = self.pad_vector.to(predicted_panels.device)
             
-        # evaluate loss
-        panel_coords_sum = torch.zeros((predicted_panels.shape[0], 2))
-        panel_coords_sum = panel_coords_sum.to(device=predicted_panels.device)
-        for el_id in range(predicted_panels.shape[0]):
-            # if unpadded len is not given, assume no padding
-            seq_len = gt_panel_num_edges[el_id] if gt_panel_num_edges is not None else predicted_panels.shape[-2]
-            if seq_len < 3:
-                # empty panel -- no need to force loop property
-                continue
-
-            # get per-coordinate sum of edges endpoints of each panel
-            # should be close to sum of the equvalent number of pading values (since all of coords are shifted due to normalization\standardization)
-            # (in case of panels, padding for edge coords should be zero, but I'm using a more generic solution here JIC)
-            panel_coords_sum[el_id] = (predicted_panels[el_id][:seq_len, :2] - self.pad_vector[:2]).sum(axis=0)
+        # evaluate loss -- for all panels at once
+        max_panel_len = predicted_panels.shape[-2]
+        if gt_panel_num_edges is not None:
+            seq_lens = torch.as_tensor(gt_panel_num_edges, device=predicted_panels.device).view(-1, 1)
+            # only the real (unpadded) edges of each panel are considered
+            edge_mask = torch.arange(max_panel_len, device=predicted_panels.device).unsqueeze(0) < seq_lens
+            # empty panels -- no need to force loop property
+            edge_mask = edge_mask & (seq_lens >= 3)
+        else:  # if unpadded len is not given, assume no padding
+            edge_mask = torch.full(
+                (predicted_panels.shape[0], max_panel_len), max_panel_len >= 3, device=predicted_panels.device)
+
+        # get per-coordinate sum of edges endpoints of each panel
+        # should be close to sum of the equvalent number of pading values (since all of coords are shifted due to normalization\standardization)
+        # (in case of panels, padding for edge coords should be zero, but I'm using a more generic solution here JIC)
+        panel_coords_sum = (
+            (predicted_panels[:, :, :2] - self.pad_vector[:2]) * edge_mask.unsqueeze(-1)
+        ).sum(dim=1)
 
         panel_square_sums = panel_coords_sum ** 2  # per sum square
 
@@ -59,6 +64,7 @@ class PatternStitchLoss():
     """
     def __init__(self, triplet_margin=0.1, use_hardnet=True):
         self.triplet_margin = triplet_margin
+        self.batch_ids = torch.arange(0).unsqueeze(-1)  # indexing helper, re-used between calls
         
         self.neg_loss = self.HardNet_neg_loss if use_hardnet else self.extended_triplet_neg_loss
 
@@ -79,25 +85,26 @@ class PatternStitchLoss():
 
         flat_stitch_tags = stitch_tags.view(batch_size, -1, stitch_tags.shape[-1])  # remove panel dimention
 
+        if self.batch_ids.shape[0] != batch_size or self.batch_ids.device != stitch_tags.device:
+            self.batch_ids = torch.arange(batch_size, device=stitch_tags.device).unsqueeze(-1)
+
         # https://stackoverflow.com/questions/55628014/indexing-a-3d-tensor-using-a-2d-tensor
         # these will have dull values due to padding in gt_stitches
-        left_sides = flat_stitch_tags[torch.arange(batch_size).unsqueeze(-1), gt_stitches[:, 0, :]]
-        right_sides = flat_stitch_tags[torch.arange(batch_size).unsqueeze(-1), gt_stitches[:, 1, :]]
-        total_tags = torch.cat([left_sides, right_sides], dim=1)
+        # both sides of stitches at once: all left sides followed by all right sides
+        total_tags = flat_stitch_tags[self.batch_ids, gt_stitches.reshape(batch_size, -1)]
+        left_sides, right_sides = total_tags.chunk(2, dim=1)
 
         # tags on both sides of the stitch -- together
-        similarity_loss_mat = (left_sides - right_sides) ** 2
+        similarity_per_stitch = ((left_sides - right_sides) ** 2).sum(dim=-1)
 
         # Gather the loss
-        similarity_loss = 0.
-        for pattern_idx in range(batch_size):
-            # ingore values calculated for padded part of gt_stitches 
-            # average by number of stitches in pattern
-            similarity_loss += (
-                similarity_loss_mat[pattern_idx][:gt_stitches_nums[pattern_idx], :].sum() 
-                / gt_stitches_nums[pattern_idx])
+        # ingore values calculated for padded part of gt_stitches 
+        stitch_ids = torch.arange(gt_stitches.shape[-1], device=stitch_tags.device)
+        real_stitches = stitch_ids.unsqueeze(0) < gt_stitches_nums.view(-1, 1)
+        # average by number of stitches in pattern
+        similarity_loss = (similarity_per_stitch * real_stitches).sum(dim=-1) / gt_stitches_nums
 
-        similarity_loss /= batch_size  # average similarity by stitch
+        similarity_loss = similarity_loss.sum() / batch_size  # average similarity by stitch
 
         # Push tags away from each other
         total_neg_loss = self.neg_loss(total_tags, gt_stitches_nums)
@@ -116,66 +123,60 @@ class PatternStitchLoss():
             * Is based on Triplet loss formula to make the distance between tags larger than margin
             * Evaluated the loss for every tag agaist every other tag (exept for the edges that are part of the same stitch thus have to have same tags)
         """
-        total_neg_loss = []
-        for idx, pattern_tags in enumerate(total_tags):  # per pattern in batch
-            # slice pattern tags to remove consideration for stitch padding
-            half_size = len(pattern_tags) // 2
-            num_stitches = gt_stitches_nums[idx]
-
-            pattern_tags = torch.cat([
-                pattern_tags[:num_stitches, :], 
-                pattern_tags[half_size:half_size + num_stitches, :]])
-
-            # eval loss
-            for tag_id, tag in enumerate(pattern_tags):
-                # Evaluate distance to other tags
-                neg_loss = (tag - pattern_tags) ** 2
-
-                # compare with margin
-                neg_loss = self.triplet_margin - neg_loss.sum(dim=-1)  # single value per other tag
-
-                # zero out losses for entries that should be equal to current tag
-                neg_loss[tag_id] = 0  # torch.zeros_like(neg_loss[tag_id]).to(neg_loss.device)
-                brother_id = tag_id + num_stitches if tag_id < num_stitches else tag_id - num_stitches
-                neg_loss[brother_id] = 0  # torch.zeros_like(neg_loss[tag_id]).to(neg_loss.device)
-
-                # ignore elements far enough from current tag
-                neg_loss = torch.max(neg_loss, torch.zeros_like(neg_loss))
-
-                # fin total
-                total_neg_loss.append(neg_loss.sum() / len(neg_loss))
+        tags_distance, valid_tags, negatives_mask = self._tags_distances(total_tags, gt_stitches_nums)
+
+        # compare with margin & ignore elements far enough from current tag
+        neg_loss = torch.clamp(self.triplet_margin - tags_distance, min=0) * negatives_mask
+
+        # mean over all tags of the pattern (including the ones that should be equal to current tag)
+        num_pattern_tags = 2 * gt_stitches_nums.view(-1, 1)
+        per_tag_loss = neg_loss.sum(dim=-1) / num_pattern_tags.clamp(min=1)
+
         # average neg loss per tag
-        return sum(total_neg_loss) / len(total_neg_loss)
+        return per_tag_loss[valid_tags].sum() / valid_tags.sum().clamp(min=1)
 
     def HardNet_neg_loss(self, total_tags, gt_stitches_nums):
         """Pushes stitch tags for different stitches away from each other
             * Is based on Triplet loss formula to make the distance between tags larger than margin
             * Uses trick from HardNet: only evaluate the loss on the closest negative example!
         """
-        total_neg_loss = []
-        for idx, pattern_tags in enumerate(total_tags):  # per pattern in batch
-            # slice pattern tags to remove consideration for stitch padding
-            half_size = len(pattern_tags) // 2
-            num_stitches = gt_stitches_nums[idx]
-
-            pattern_tags = torch.cat([
-                pattern_tags[:num_stitches, :], 
-                pattern_tags[half_size:half_size + num_stitches, :]])
-
-            for tag_id, tag in enumerate(pattern_tags):
-                # Evaluate distance to other tags
-                tags_distance = ((tag - pattern_tags) ** 2).sum(dim=-1)
-
-                # mask values corresponding to current tag for min() evaluation
-                tags_distance[tag_id] = float('inf')
-                brother_id = tag_id + num_stitches if tag_id < num_stitches else tag_id - num_stitches
-                tags_distance[brother_id] = float('inf')
-
-                # compare with margin
-                neg_loss = self.triplet_margin - tags_distance.min()  # single value per other tag
-
-                # ignore if all tags are far enough from current tag
-                total_neg_loss.append(max(neg_loss, 0))
+        tags_distance, valid_tags, negatives_mask = self._tags_distances(total_tags, gt_stitches_nums)
+
+        # mask values corresponding to current tag (and the padding) for min() evaluation
+        closest_negative = tags_distance.masked_fill(~negatives_mask, float('inf')).amin(dim=-1)
+
+        # compare with margin & ignore if all tags are far enough from current tag
+        neg_loss = torch.clamp(self.triplet_margin - closest_negative, min=0)
+
         # average neg loss per tag
-        return sum(total_neg_loss) / len(total_neg_loss)
+        return neg_loss[valid_tags].sum() / valid_tags.sum().clamp(min=1)
+
+    def _tags_distances(self, total_tags, gt_stitches_nums):
+        """Squared distances between all the pairs of stitch tags in every pattern of the batch
+            * total_tags -- (batch, 2 * max_num_stitches, tag_len): left sides of stitches followed by the right sides 
+            Returns the distances and masks that allow to ignore stitch padding:
+            * valid_tags -- (batch, 2 * max_num_stitches) tags that belong to real stitches
+            * negatives_mask -- (batch, 2 * max_num_stitches, 2 * max_num_stitches) pairs of valid tags 
+                that should be different (not the tag itself or the other side of the same stitch)
+        """
+        num_tags = total_tags.shape[1]
+        half_size = num_tags // 2
+        device = total_tags.device
+
+        # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b -- one batched matmul instead of (batch, num_tags, num_tags, tag_len) differences
+        tags_norms = (total_tags ** 2).sum(dim=-1)
+        tags_distance = tags_norms.unsqueeze(2) + tags_norms.unsqueeze(1) - 2 * torch.bmm(total_tags, total_tags.transpose(1, 2))
+        tags_distance = tags_distance.clamp(min=0)  # round-off could make it slightly negative
+
+        # tags of real stitches are at the start of each half
+        tag_ids = torch.arange(num_tags, device=device)
+        valid_tags = (tag_ids % half_size).unsqueeze(0) < gt_stitches_nums.to(device).view(-1, 1)
+
+        # the tag itself & the brother tag on the other side of the stitch
+        brother_ids = (tag_ids + half_size) % num_tags
+        same_stitch = tag_ids.unsqueeze(1) == tag_ids.unsqueeze(0)
+        same_stitch[tag_ids, brother_ids] = True
+
+        negatives_mask = valid_tags.unsqueeze(2) & valid_tags.unsqueeze(1) & ~same_stitch
 
+        return tags_distance, valid_tags, negatives_mask
@@ -21,6 +21,7 @@ class PatternStitchPrecisionRecall():
             for key in self.data_stats:
                 self.data_stats[key] = torch.Tensor(self.data_stats[key])
 
+    @torch.no_grad()  # not differentiable anyway -- don't record the graph
     def __call__(
             self, 
             stitch_tags, free_edge_class, 
@@ -31,8 +32,10 @@ class PatternStitchPrecisionRecall():
         """
         # undo stats application if provided
         if self.data_stats is not None:
-            device = stitch_tags.device
-            stitch_tags = stitch_tags * self.data_stats['scale'].to(device) + self.data_stats['shift'].to(device)
+            for key in self.data_stats:  # move once & keep on device
+                if self.data_stats[key].device != stitch_tags.device:
+                    self.data_stats[key] = self.data_stats[key].to(stitch_tags.device)
+            stitch_tags = stitch_tags * self.data_stats['scale'] + self.data_stats['shift']
         
         tot_precision = 0.
         tot_recall = 0.
@@ -46,18 +49,17 @@ class PatternStitchPrecisionRecall():
                 continue
             num_actual_stitches = gt_stitches_nums[pattern_idx]
             
-            # compare stitches
-            correct_stitches = 0.
-            for detected in stitch_list.transpose(0, 1):
-                for actual in gt_stitches[pattern_idx][:, :gt_stitches_nums[pattern_idx]].transpose(0, 1):
-                    # order-invariant comparison of stitch sides
-                    correct = (all(detected == actual) or all(detected == actual.flip([0])))
-                    correct_stitches += correct
-                    if correct:  # no need to check subsequent stitches
-                        break
- 
-                if pattern_names is not None and not correct:  # never detected a match with actual stitches
-                    print('StitchPrecisionRecall::{}::Stitch {} detected wrongly'.format(pattern_names[pattern_idx], detected))
+            # compare stitches: all detected against all actual at once
+            detected = stitch_list.transpose(0, 1).unsqueeze(1)
+            actual = gt_stitches[pattern_idx][:, :gt_stitches_nums[pattern_idx]].transpose(0, 1).unsqueeze(0)
+            # order-invariant comparison of stitch sides
+            matches = (detected == actual).all(dim=-1) | (detected == actual.flip([-1])).all(dim=-1)
+            detected_correct = matches.any(dim=1)
+            correct_stitches = float(detected_correct.sum())
+
+            if pattern_names is not None:
+                for wrong in stitch_list.transpose(0, 1)[~detected_correct]:  # never detected a match with actual stitches
+                    print('StitchPrecisionRecall::{}::Stitch {} detected wrongly'.format(pattern_names[pattern_idx], wrong))
 
             # precision -- how many of the detected stitches are actually there
             precision = correct_stitches / num_detected_stitches if num_detected_stitches else 0.
@@ -104,7 +106,7 @@ class NumbersInPanelsAccuracies():
         self.data_stats = data_stats
         self.max_panel_len = max_edges_in_panel
         self.pad_vector = eval_pad_vector(data_stats)
-        self.empty_panel_template = self.pad_vector.repeat(self.max_panel_len, 1)
+        self.empty_panel_template = self.pad_vector.unsqueeze(0)  # broadcasts over all panel edges -- no need for a full copy
         self.panel_loop_threshold = torch.tensor([3, 3]) / torch.Tensor(data_stats['scale'])[:2]  # 3 cm per coordinate is a tolerable error
 
     def __call__(self, predicted_outlines, gt_num_edges, gt_panel_nums, pattern_names=None):
@@ -259,21 +261,21 @@ class PanelVertsL2():
     def _to_verts(self, panel_edges):
         """Convert normalized panel edges into the vertex representation"""
 
-        vert_list = [torch.tensor([0, 0]).to(panel_edges.device)]  # always starts at zero
-        # edge: first two elements are the 2D vector coordinates, next two elements are curvature coordinates
-        for edge in panel_edges:
-            next_vertex = vert_list[-1] + edge[:2]
-            edge_perp = torch.tensor([-edge[1], edge[0]]).to(panel_edges.device)
-
-            # NOTE: on non-curvy edges, the curvature vertex in panel space will be on the previous vertex
-            #       it might result in some error amplification, but we could not find optimal yet simple solution
-            next_curvature = vert_list[-1] + edge[2] * edge[:2]  # X curvature coordinate
-            next_curvature = next_curvature + edge[3] * edge_perp  # Y curvature coordinate
-
-            vert_list.append(next_curvature)
-            vert_list.append(next_vertex)
-
-        vertices = torch.stack(vert_list)
+        # all edges at once: first two elements are the 2D vector coordinates, next two elements are curvature coordinates
+        edge_vectors = panel_edges[:, :2]
+        end_vertices = torch.cumsum(edge_vectors, dim=0)
+        start_vertices = torch.cat([torch.zeros_like(end_vertices[:1]), end_vertices[:-1]])  # always starts at zero
+        edge_perps = torch.stack([-panel_edges[:, 1], panel_edges[:, 0]], dim=1)
+
+        # NOTE: on non-curvy edges, the curvature vertex in panel space will be on the previous vertex
+        #       it might result in some error amplification, but we could not find optimal yet simple solution
+        curvature_vertices = start_vertices + panel_edges[:, 2:3] * edge_vectors  # X curvature coordinate
+        curvature_vertices = curvature_vertices + panel_edges[:, 3:4] * edge_perps  # Y curvature coordinate
+
+        # origin, then curvature vertex & end vertex of every edge
+        vertices = torch.cat([
+            torch.zeros_like(end_vertices[:1]), 
+            torch.stack([curvature_vertices, end_vertices], dim=1).view(-1, 2)])
 
         # align with the center
         vertices = vertices - torch.mean(vertices, axis=0)  # shift to average coordinate
@@ -26,6 +26,15 @@ class BaseModule(nn.Module):
         loss = self.regression_loss(preds, ground_truth)
         return loss, {'regression loss': loss}, False  # second term is for compound losses, third -- to indicate dynamic update of loss structure
 
+    def compile_submodules(self, mode='default'):
+        """Compile forward passes of the direct sub-modules in-place with torch.compile (PyTorch 2.x)
+            * Parameter names are not affected => saved checkpoints stay compatible
+            * Replicas created by nn.DataParallel would still call the original module's forward, so use with a single device only
+            * Only the code that goes through the children forward() calls is compiled -- children can extend this
+        """
+        for module in self.children():
+            module.forward = torch.compile(module.forward, mode=mode)
+
     def train(self, mode=True):
         super().train(mode)
         if isinstance(self.loss, object):
@@ -151,17 +160,18 @@ class GarmentFullPattern3D(BaseModule):
         
         # Placement
         flat_placement = self.placement_decoder(flat_panel_encodings)
-        flat_rotations = flat_placement[:, :self.rotation_size]
-        flat_translations = flat_placement[:, self.rotation_size:]
 
         # reshape back to per-pattern predictions
-        panel_predictions = flat_panels.contiguous().view(batch_size, self.max_pattern_size, self.max_panel_len, -1)
+        # NOTE reshape only copies when the input is not contiguous already; slices are views
+        panel_predictions = flat_panels.reshape(batch_size, self.max_pattern_size, self.max_panel_len, -1)
         stitch_tags = panel_predictions[:, :, :, self.panel_elem_len:-1]
         free_edge_class = panel_predictions[:, :, :, -1]
         outlines = panel_predictions[:, :, :, :self.panel_elem_len]
 
-        rotations = flat_rotations.contiguous().view(batch_size, self.max_pattern_size, -1)
-        translations = flat_translations.contiguous().view(batch_size, self.max_pattern_size, -1)
+        # split after reshaping the whole placement at once (the column slices are not contiguous)
+        placement = flat_placement.view(batch_size, self.max_pattern_size, -1)
+        rotations = placement[:, :, :self.rotation_size]
+        translations = placement[:, :, self.rotation_size:]
 
         return {
             'outlines': outlines, 
@@ -235,6 +245,13 @@ class GarmentSegmentPattern3D(GarmentFullPattern3D):
         # pattern decoder is not needed in this acrchitecture
         del self.pattern_decoder
 
+        # settings used on every forward pass -- resolved once here
+        self.local_attention = self.config['local_attention']
+        extractor_config = self.feature_extractor.config
+        # equal number of points per garment => weighted sum-pool of panel features is a batched matrix product
+        self.panel_pool_matmul = extractor_config['global_pool'] in ['mean', 'add'] and not extractor_config['graph_pooling']
+        self.panel_pool_mean = extractor_config['global_pool'] == 'mean'
+
     def forward_panel_enc_from_3d(self, positions_batch):
         """
             Get per-panel encodings from 3D data directly
@@ -245,43 +262,67 @@ class GarmentSegmentPattern3D(GarmentFullPattern3D):
         # per-point and total encodings
         init_pattern_encodings, point_features_flat, batch = self.feature_extractor(
             positions_batch, 
-            not self.config['local_attention']  # don't need global pool in this case
+            not self.local_attention  # don't need global pool in this case
         )
         num_points = point_features_flat.shape[0] // batch_size
 
         # ----- Predict per-point panel scores (as attention weights) -----
         # propagate the per-pattern global encoding for each point
-        if self.config['local_attention']:
+        if self.local_attention:
             points_weights = self.point_segment_mlp(point_features_flat)
         else:
-            global_enc_propagated = init_pattern_encodings.unsqueeze(1).repeat(1, num_points, 1).view(
-                [-1, init_pattern_encodings.shape[-1]])
-
-            points_weights = self.point_segment_mlp(torch.cat([global_enc_propagated, point_features_flat], dim=-1))
+            points_weights = self._segment_with_global_enc(init_pattern_encodings, point_features_flat, num_points)
 
         # ----- Getting per-panel features after attention application ------
-        all_panel_features = []
-        for panel_id in range(points_weights.shape[-1]):
-            # get weights for particular panel
-            panel_att_weights = points_weights[:, panel_id].unsqueeze(-1)
-
-            # weight and pool to get panel encoding
-            weighted_features = panel_att_weights * point_features_flat
-
-            # same pool as in intial extractor
-            panel_feature = self.feature_extractor.global_pool(weighted_features, batch, batch_size) 
-            panel_feature = self.panel_dec_lin(panel_feature)  # reshape as needed
-            panel_feature = panel_feature.view(batch_size, -1, panel_feature.shape[-1])
-
-            all_panel_features.append(panel_feature)
+        # weight and pool to get panel encodings -- for all panels at once
+        num_panels = points_weights.shape[-1]
+        feature_size = point_features_flat.shape[-1]
+        if self.panel_pool_matmul:
+            panel_features = torch.einsum(
+                'bnp,bnf->bpf', 
+                points_weights.view(batch_size, num_points, num_panels), 
+                point_features_flat.view(batch_size, num_points, feature_size))
+            if self.panel_pool_mean:
+                panel_features = panel_features / num_points
+        else:
+            # same pool as in intial extractor, applied to all panels' weighted features together
+            weighted_features = points_weights.unsqueeze(-1) * point_features_flat.unsqueeze(1)
+            panel_features = self.feature_extractor.global_pool(
+                weighted_features.view(-1, num_panels * feature_size), batch, batch_size) 
+            panel_features = panel_features.view(batch_size, num_panels, feature_size)
 
-        panel_encodings = torch.cat(all_panel_features, dim=1)  # concat in pattern dimention
-        panel_encodings = panel_encodings.view(batch_size, -1, panel_encodings.shape[-1])
+        panel_encodings = self.panel_dec_lin(panel_features)  # (batch_size, num_panels, encoding)
 
         points_weights = points_weights.view(batch_size, -1, points_weights.shape[-1]) if self.save_att_weights else []
 
         return panel_encodings, points_weights
 
+    def _segment_with_global_enc(self, global_encodings, point_features_flat, num_points):
+        """Same as self.point_segment_mlp(torch.cat([global_enc_propagated, point_features_flat], dim=-1)),
+            but without materializing the copy of global encoding for every point: 
+            the first linear layer is split into global & per-point parts that are summed with broadcasting
+        """
+        mlp, sparsemax = self.point_segment_mlp
+        first_linear = mlp[0][0]
+        enc_size = global_encodings.shape[-1]
+
+        global_part = nn.functional.linear(global_encodings, first_linear.weight[:, :enc_size], first_linear.bias)
+        points_part = nn.functional.linear(point_features_flat, first_linear.weight[:, enc_size:])
+        hidden = (points_part.view(global_part.shape[0], num_points, -1) + global_part.unsqueeze(1)).view(
+            -1, global_part.shape[-1])
+
+        hidden = mlp[0][1:](hidden)  # the rest of the first layer
+        hidden = mlp[1:](hidden)
+        return sparsemax(hidden)
+
+    def compile_submodules(self, mode='default'):
+        """Compile sub-modules forward passes (see BaseModule)
+            * Global feature path calls parts of self.point_segment_mlp directly, so this routine is compiled too
+        """
+        super().compile_submodules(mode)
+        if not self.local_attention:
+            self._segment_with_global_enc = torch.compile(self._segment_with_global_enc, mode=mode)
+
     def forward(self, positions_batch, **kwargs):
         """3D to pattern with attention on per-point features"""
 
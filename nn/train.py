@@ -1,7 +1,9 @@
-from distutils import dir_util
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import argparse
 import numpy as np
+import os
+import shutil
 import torch.nn as nn
 import yaml
 
@@ -69,8 +71,19 @@ def merge_repos(root, repos):
     merge_target = root / 'merged'
     merge_target.mkdir(exist_ok=True)
 
+    # collect all the copies first: for files present in several repos the last repo wins
+    copies = {}
     for repo in repos:
-        dir_util.copy_tree(str(root / repo), str(merge_target))
+        repo_root = root / repo
+        for dirpath, _, filenames in os.walk(repo_root):
+            target_dir = merge_target / Path(dirpath).relative_to(repo_root)
+            target_dir.mkdir(parents=True, exist_ok=True)
+            for filename in filenames:
+                copies[target_dir / filename] = Path(dirpath) / filename
+
+    # copying is IO-bound => threads are enough
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(lambda dst: shutil.copy2(copies[dst], dst), copies))
     
     return merge_target
 
@@ -119,6 +132,13 @@ if __name__ == "__main__":
     trainer.init_randomizer()
     model_class = getattr(nets, config['NN']['model'])
     model = model_class(dataset.config, config['NN'], config['NN']['loss'])
+    if 'compile' in config['NN'] and config['NN']['compile']:
+        if len(config['trainer']['devices']) > 1:
+            print('Train::Warning::Model compilation is only supported for single-device training. Using eager mode')
+        else:
+            # NN.compile could be set to the compilation mode, e.g. 'reduce-overhead' to replay CUDA graphs of the fixed-shape steps
+            compile_mode = config['NN']['compile'] if isinstance(config['NN']['compile'], str) else 'default'
+            model.compile_submodules(mode=compile_mode)
 
     # Multi-GPU!!!
     model = nn.DataParallel(model, device_ids=config['trainer']['devices'])
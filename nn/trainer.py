@@ -1,4 +1,7 @@
 # Training loop func
+import contextlib
+import inspect
+import math
 from pathlib import Path
 import time
 import traceback
@@ -45,7 +48,11 @@ class Trainer():
 
     def use_dataset(self, dataset, split_info):
         """Use specified dataset for training with given split settings"""
-        self.datawraper = data.DatasetWrapper(dataset)
+        # NOTE worker processes keep their own copies of the dataset caches, hence workers are opt-in
+        self.datawraper = data.DatasetWrapper(
+            dataset, 
+            num_workers=self.setup['num_workers'] if 'num_workers' in self.setup else 0,
+            prefetch_factor=self.setup['prefetch_factor'] if 'prefetch_factor' in self.setup else 2)
         self.datawraper.load_split(split_info)
         self.datawraper.new_loaders(self.setup['batch_size'], shuffle_train=True)
 
@@ -62,12 +69,16 @@ class Trainer():
         self.device = model.device_ids[0] if hasattr(model, 'device_ids') else self.setup['devices'][0]
         
         self._add_optimizer(model)
-        self._add_scheduler(len(self.datawraper.loaders.train))
+        self._add_scheduler(math.ceil(len(self.datawraper.loaders.train) / self._accumulation_steps()))
         self.es_tracking = []  # early stopping init
 
         start_epoch = self._start_experiment(model)
         print('Trainer::NN training Using device: {}'.format(self.device))
 
+        if 'data_on_device' in self.setup and self.setup['data_on_device']:
+            # small datasets could stay on GPU for the whole training
+            self.datawraper.cache_on_device(self.device)
+
         if self.log_with_visualization:
             # to run parent dir -- wandb will automatically keep track of intermediate values
             # Othervise it might only display the last value (if saving with the same name every time)
@@ -86,26 +97,57 @@ class Trainer():
         log_step = wb.run.step - 1
         best_valid_loss = self.experiment.last_best_validation_loss()
         best_valid_loss = torch.tensor(best_valid_loss) if best_valid_loss is not None else None
+
+        # mixed precision (opt-in)
+        amp_dtype = self._amp_dtype()
+        scaler = torch.amp.GradScaler('cuda', enabled=amp_dtype == torch.float16)  # bfloat16 does not need loss scaling
+        accumulation_steps = self._accumulation_steps()
+        # per-step logs are sent in groups s.t. reading loss values to host does not stall every step
+        log_buffer_steps = self.setup['log_buffer_steps'] if 'log_buffer_steps' in self.setup else 10
+        pending_logs = []
+        # run settings used in the loop -- read from wandb config once
+        num_epochs = wb.config.trainer['epochs']
+        self.es_settings = wb.config.trainer['early_stopping']
+        steps_per_epoch = len(train_loader)
         
-        for epoch in range(start_epoch, wb.config.trainer['epochs']):
+        for epoch in range(start_epoch, num_epochs):
             model.train()
-            for i, batch in enumerate(train_loader):
-                features, gt = batch['features'].to(self.device), batch['ground_truth']   # .to(self.device)
+            # async copies of the next batch overlap with the current step (pinned loaders on GPU)
+            for i, (batch, features) in enumerate(self.datawraper.device_batches(train_loader, self.device, with_ground_truth=True)):
+                gt = batch['ground_truth']
+                # gradients are accumulated over a few batches before the optimizer step (if requested)
+                update_step = (i + 1) % accumulation_steps == 0 or (i + 1) == steps_per_epoch
+                # the last group of the epoch might be shorter -- average over its actual size
+                group_size = min(accumulation_steps, steps_per_epoch - (i // accumulation_steps) * accumulation_steps)
+                # gradient synchronization across processes is only needed for the update step (DistributedDataParallel)
+                sync_context = model.no_sync() if not update_step and hasattr(model, 'no_sync') else contextlib.nullcontext()
                 
-                # with torch.autograd.detect_anomaly():
-                loss, loss_dict, loss_structure_update = model.module.loss(model(features, log_step=log_step, epoch=epoch), gt, epoch=epoch)
-                loss.backward()
-                self.optimizer.step()
-                self.optimizer.zero_grad()
-                if self.scheduler is not None:
-                    self.scheduler.step()
+                with sync_context:
+                    # with torch.autograd.detect_anomaly():
+                    with torch.autocast('cuda', dtype=amp_dtype, enabled=amp_dtype is not None):
+                        preds = model(features, log_step=log_step, epoch=epoch)
+                    if amp_dtype is not None:
+                        preds = self._to_float(preds)  # loss is evaluated in full precision
+                    loss, loss_dict, loss_structure_update = model.module.loss(preds, gt, epoch=epoch)
+                    scaler.scale(loss / group_size).backward()
+
+                if update_step:
+                    scaler.step(self.optimizer)
+                    scaler.update()
+                    self.optimizer.zero_grad(set_to_none=True)  # no need to write zeros over all the gradients
+                    if self.scheduler is not None:
+                        self.scheduler.step()
                 if hasattr(model.module, 'step'):  # custom model hyperparams scheduling
-                    model.module.step(i, len(train_loader))
+                    model.module.step(i, steps_per_epoch)
                 
                 # logging
                 log_step += 1
                 loss_dict.update({'epoch': epoch, 'batch': i, 'loss': loss, 'learning_rate': self.optimizer.param_groups[0]['lr']})
-                wb.log(loss_dict, step=log_step)
+                pending_logs.append((self._detached(loss_dict), log_step))
+                if len(pending_logs) >= log_buffer_steps:
+                    self._flush_logs(pending_logs)
+
+            self._flush_logs(pending_logs)  # before any epoch-level logging
 
             # Check the cluster assignment history
             if hasattr(model.module.loss, 'cluster_resolution_mapping') and model.module.loss.debug_prints:
@@ -114,8 +156,12 @@ class Trainer():
             # scheduler step: after optimizer step, see https://pytorch.org/docs/stable/optim.html#how-to-adjust-learning-rate
             model.eval()
             with torch.no_grad():
-                losses = [model.module.loss(model(batch['features'].to(self.device)), batch['ground_truth'], epoch=epoch)[0] for batch in valid_loader]
-                valid_loss = sum(losses) / len(losses)  # Each loss element is already a mean for its batch
+                # running sum stays on device -- no per-batch syncs & no list of per-batch results
+                valid_loss, num_batches = 0., 0
+                for batch, features in self.datawraper.device_batches(valid_loader, self.device, with_ground_truth=True):
+                    valid_loss += model.module.loss(model(features), batch['ground_truth'], epoch=epoch)[0]
+                    num_batches += 1
+                valid_loss = valid_loss / num_batches  # Each loss element is already a mean for its batch
 
             # Checkpoints: & compare with previous best
             if loss_structure_update or best_valid_loss is None or valid_loss < best_valid_loss:  # taking advantage of lazy evaluation
@@ -161,15 +207,66 @@ class Trainer():
 
     def _add_optimizer(self, model):
         
+        model.to(self.device)  # see https://discuss.pytorch.org/t/effect-of-calling-model-cuda-after-constructing-an-optimizer/15165/8
         if self.setup['optimizer'] == 'SGD':
             # future 'else'
             print('Trainer::Using default SGD optimizer')
-            self.optimizer = torch.optim.SGD(model.parameters(), lr=self.setup['learning_rate'], weight_decay=self.setup['weight_decay'])
+            self.optimizer = torch.optim.SGD(
+                model.parameters(), lr=self.setup['learning_rate'], weight_decay=self.setup['weight_decay'], 
+                momentum=self.setup['momentum'] if 'momentum' in self.setup else 0,
+                **self._multi_tensor_options(torch.optim.SGD))
         elif self.setup['optimizer'] == 'Adam':
             # future 'else'
             print('Trainer::Using Adam optimizer')
-            model.to(self.device)  # see https://discuss.pytorch.org/t/effect-of-calling-model-cuda-after-constructing-an-optimizer/15165/8
-            self.optimizer = torch.optim.Adam(model.parameters(), lr=self.setup['learning_rate'], weight_decay=self.setup['weight_decay'])
+            self.optimizer = torch.optim.Adam(
+                model.parameters(), lr=self.setup['learning_rate'], weight_decay=self.setup['weight_decay'], 
+                **self._multi_tensor_options(torch.optim.Adam))
+
+    def _multi_tensor_options(self, optimizer_class):
+        """Update all the parameters with a few multi-tensor kernels instead of per-parameter ones when on GPU:
+            fused implementation if the installed PyTorch has it for the optimizer, foreach otherwise
+        """
+        if torch.device(self.device).type != 'cuda':
+            return {}
+        options = inspect.signature(optimizer_class).parameters
+        if 'fused' in options:
+            return {'fused': True}
+        if 'foreach' in options:
+            return {'foreach': True}
+        return {}
+
+    def _accumulation_steps(self):
+        """Number of batches to accumulate gradients from before each optimizer step"""
+        return self.setup['accumulation_steps'] if 'accumulation_steps' in self.setup else 1
+
+    def _amp_dtype(self):
+        """Data type for mixed precision training if requested in setup ('amp', 'amp_dtype'), None otherwise"""
+        if 'amp' not in self.setup or not self.setup['amp']:
+            return None
+        if torch.device(self.device).type != 'cuda':
+            print('Trainer::Warning::Mixed precision is only used for training on GPU. Using float32')
+            return None
+        dtype_name = self.setup['amp_dtype'] if 'amp_dtype' in self.setup else 'bfloat16'
+        print('Trainer::Using mixed precision training with {}'.format(dtype_name))
+        return getattr(torch, dtype_name)
+
+    def _to_float(self, preds):
+        """Cast (dictionary of) predictions to float32"""
+        if isinstance(preds, dict):
+            return {key: self._to_float(value) for key, value in preds.items()}
+        if isinstance(preds, torch.Tensor) and torch.is_floating_point(preds):
+            return preds.float()
+        return preds
+
+    def _detached(self, loss_dict):
+        """Loss values without the computational graph -- s.t. the graph is not kept alive while waiting for logging"""
+        return {key: value.detach() if isinstance(value, torch.Tensor) else value for key, value in loss_dict.items()}
+
+    def _flush_logs(self, pending_logs):
+        """Send the buffered per-step logs to wandb. Only the first value read waits for the device"""
+        for log_dict, step in pending_logs:
+            wb.log(log_dict, step=step)
+        pending_logs.clear()
 
     def _add_scheduler(self, steps_per_epoch):
         if 'lr_scheduling' in self.setup:
@@ -223,12 +320,12 @@ class Trainer():
 
         # Target metric is not improving for some time
         self.es_tracking.append(last_tracking_loss.item())
-        if len(self.es_tracking) > (wb.config.trainer['early_stopping']['patience'] + 1):  # number of last calls to consider plus current -> at least two
+        if len(self.es_tracking) > (self.es_settings['patience'] + 1):  # number of last calls to consider plus current -> at least two
             self.es_tracking.pop(0)
             # if all values fit into a window, they don't change much
-            if abs(max(self.es_tracking) - min(self.es_tracking)) < wb.config.trainer['early_stopping']['window']:
+            if abs(max(self.es_tracking) - min(self.es_tracking)) < self.es_settings['window']:
                 self.experiment.add_statistic(
-                    'stopped early', 'Metric have not changed for {} epochs'.format(wb.config.trainer['early_stopping']['patience']), 
+                    'stopped early', 'Metric have not changed for {} epochs'.format(self.es_settings['patience']), 
                     log='Trainer::EarlyStopping')
                 return True
         # do not check untill wb.config.trainer['early_stopping'].patience # of calls are gathered